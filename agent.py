@@ -1,17 +1,34 @@
 import os
-import subprocess
+import re
+import sys
+import hashlib
+import importlib.util
+import traceback
 import pandas as pd
 import argparse
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
-import pdfplumber
+from langchain_core.caches import InMemoryCache
+from langchain_core.globals import get_llm_cache, set_llm_cache
+import pymupdf
+from custom_parsers import page_lines
+from functools import lru_cache
 
 # --- Configuration & Setup ---
 MAX_ATTEMPTS = 3
 TARGET_PARSER_PATH = "custom_parsers/icici_parser.py"
+TARGET_PARSER_MODULE = "custom_parsers.icici_parser"
 TARGET_CSV_PATH = "data/icici/result.csv"
 TARGET_PDF_PATH = "data/icici/icici_sample.pdf"
+CACHE_DIR = ".agent_cache"
+# Output budget for one generated parser, and where generation stops: a closing fence
+# followed by a blank line means the model has moved on from the code
+MAX_OUTPUT_TOKENS = 1500
+STOP_SEQUENCES = ["```\n\n"]
+
+# Markdown code fences (optionally tagged `python`) at the start or end of a line
+_FENCE_RE = re.compile(r'^```(?:python)?\n?|\n?```$', re.M)
 
 def setup_environment():
     """Loads environment variables for the API key."""
@@ -20,19 +37,37 @@ def setup_environment():
         raise ValueError("GROQ_API_KEY not found in .env file")
 
 def get_llm():
-    """Initializes and returns the Groq LLM client."""
-    return ChatGroq(model_name="Llama-3.1-8B-Instant", temperature=0)
+    """Initializes and returns the Groq LLM client, with identical prompts answered from an in-memory cache."""
+    if get_llm_cache() is None:
+        set_llm_cache(InMemoryCache())
+    return ChatGroq(model_name="Llama-3.1-8B-Instant", temperature=0,
+                    max_tokens=MAX_OUTPUT_TOKENS, stop=STOP_SEQUENCES)
+
+@lru_cache(maxsize=8)
+def _read_pdf_text_sample(pdf_path):
+    """Reads the first page of the PDF as text lines; errors propagate so they are never cached."""
+    with pymupdf.open(pdf_path) as doc:
+        # Rebuild visual lines from the words, since plain text output puts each table cell on its own line
+        return "\n".join(page_lines(doc[0]))
 
 def get_pdf_text_sample(pdf_path):
     """Extracts text from the first page of the PDF to give the LLM context."""
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            first_page = pdf.pages[0]
-            return first_page.extract_text()
+        return _read_pdf_text_sample(pdf_path)
     except Exception as e:
         print(f"Could not read PDF for context: {e}")
         return "Could not extract text."
 
+@lru_cache(maxsize=8)
+def _render_schema(columns, rows):
+    """Renders the given header rows as a markdown table."""
+    return str(pd.DataFrame(list(rows), columns=list(columns)).to_markdown())
+
+def get_schema_info(expected_df):
+    """Returns the first rows of the ground truth as markdown, reusing earlier renders of the same rows."""
+    head = expected_df.head().astype(str)
+    return _render_schema(tuple(head.columns), tuple(head.itertuples(index=False, name=None)))
+
 # --- Agent Core Logic ---
 
 def create_prompt_template():
@@ -47,7 +82,7 @@ def create_prompt_template():
          1.  Your output MUST be ONLY Python code. Nothing else.
          2.  Do not include markdown fences like ```python or ```.
          3.  Do not include any English explanations.
-         4.  Use `pdfplumber` to read the PDF text line by line. Do not use table extraction tools.
+         4.  Use `pymupdf` to read the PDF text line by line, rebuilding lines from `page.get_text("words")` grouped by their y-coordinate. Do not use table extraction tools.
          5.  The PDF has transaction data that begins after a header row.
          6.  A transaction line can be identified by its structure: the first word is a date, the last is a balance, and the second to last is an amount. Everything between the date and the amount is the description.
          7.  The final DataFrame must have these exact columns: ['Date', 'Description', 'Debit Amt', 'Credit Amt', 'Balance'].
@@ -81,8 +116,11 @@ def create_prompt_template():
          - Balance: 11524.79
          
          Notice that for a debit transaction, the 'Credit Amt' can be 0, and vice-versa. The column names must be exactly 'Date', 'Description', 'Debit Amt', 'Credit Amt', 'Balance'.
-
-         {error_feedback}
+         """),
+        # Only this last message changes between attempts, so everything above stays a
+        # stable prefix that the provider can reuse from its prompt cache
+        ("human",
+         """{error_feedback}
 
          Now, please generate the complete Python code for the `{parser_path}` file.
          """),
@@ -98,80 +136,113 @@ def generate_parser_code(llm, prompt, schema, pdf_sample, error_feedback=""):
         "error_feedback": error_feedback
     })
     
-    # More robustly clean the response to ensure it's just code
-    code = response.content.strip()
-    
-    # Remove markdown code fences and the word 'python'
-    if code.startswith("```python"):
-        code = code[9:]
-    elif code.startswith("```"):
-        code = code[3:]
-        
-    if code.endswith("```"):
-        code = code[:-3]
-        
-    return code.strip()
+    # Strip markdown code fences so only the code itself is left
+    return _FENCE_RE.sub('', response.content).strip()
 
 def save_code_to_file(code):
     """Saves the generated code to the specified parser file."""
-    # Remove all triple backticks from code
-    code = code.replace("```", "")
     os.makedirs(os.path.dirname(TARGET_PARSER_PATH), exist_ok=True)
     with open(TARGET_PARSER_PATH, "w") as f:
         f.write(code)
     print(f"✅ Agent has written the parser to {TARGET_PARSER_PATH}")
 
 
-def test_generated_parser():
+def frames_match(actual_df, expected_df):
+    """Fast check that two DataFrames have the same columns, index and rows in the same order."""
+    if list(actual_df.columns) != list(expected_df.columns) or not actual_df.index.equals(expected_df.index):
+        return False
+    actual_hashes = pd.util.hash_pandas_object(actual_df, index=False).to_numpy()
+    expected_hashes = pd.util.hash_pandas_object(expected_df, index=False).to_numpy()
+    return bool((actual_hashes == expected_hashes).all())
+
+def load_parser_module(parser_path):
+    """Executes the parser file in a brand-new module, so nothing defined by an earlier attempt survives."""
+    spec = importlib.util.spec_from_file_location(TARGET_PARSER_MODULE, parser_path)
+    parser_module = importlib.util.module_from_spec(spec)
+    # Compile the source directly rather than via the loader, so a stale .pyc left by a
+    # rewrite within the same second is never picked up
+    with open(parser_path) as f:
+        code = compile(f.read(), parser_path, "exec")
+    # Registered before executing, like a normal import, so the parser's functions can be pickled
+    sys.modules[TARGET_PARSER_MODULE] = parser_module
+    exec(code, parser_module.__dict__)
+    return parser_module
+
+def test_generated_parser(expected_df, parser_path=None):
     """
-    Tests the generated parser by running it and comparing its output DataFrame
-    with the ground truth CSV. Returns (is_correct, error_message).
+    Tests the generated parser by loading it in-process and comparing its output
+    DataFrame with the ground truth DataFrame loaded once from the CSV.
+    Unlike the old subprocess runner there is no timeout, so a parser that hangs
+    blocks the agent. Returns (is_correct, error_message).
     """
     try:
-        # Use subprocess to run the parser in an isolated environment
-        # This is safer and catches a wider range of errors
-        script_to_run = f"""
-import pandas as pd
-import traceback  # <-- This was the missing line
-from custom_parsers.icici_parser import parse
+        # Load the parser into a fresh module so each attempt runs only the freshly written code,
+        # without paying for a new interpreter and re-importing pandas/pymupdf
+        parser_module = load_parser_module(parser_path or TARGET_PARSER_PATH)
 
-try:
-    # Attempt to parse the PDF and load the expected CSV
-    generated_df = parse('{TARGET_PDF_PATH}')
-    expected_df = pd.read_csv('{TARGET_CSV_PATH}')
-    
-    # Compare the generated DataFrame with the expected one
-    pd.testing.assert_frame_equal(generated_df.astype(str), expected_df.astype(str))
-    
-    # If the comparison passes, print SUCCESS
-    print("SUCCESS")
-
-except Exception as e:
-    # If any error occurs during parsing or comparison, print the full traceback
-    print(f"Execution Error:\\n{{traceback.format_exc()}}")
-"""
-        result = subprocess.run(['python', '-c', script_to_run], capture_output=True, text=True, timeout=30)
-        
-        if "SUCCESS" in result.stdout:
-            return True, ""
-        else:
-            error = result.stderr if result.stderr else result.stdout
-            return False, f"Testing failed. Error:\n{error}"
+        # Attempt to parse the PDF
+        generated_df = parser_module.parse(TARGET_PDF_PATH)
+
+        # Compare the generated DataFrame with the expected one; matching row hashes is the
+        # common fast path, otherwise the full comparison decides and explains any mismatch
+        if not frames_match(generated_df, expected_df):
+            pd.testing.assert_frame_equal(generated_df.astype(str), expected_df.astype(str))
+        return True, ""
+
+    except (Exception, SystemExit):
+        # If any error occurs during import, parsing or comparison, report the full traceback;
+        # a sys.exit()/exit() in the generated code becomes feedback instead of ending the agent
+        return False, f"Testing failed. Error:\nExecution Error:\n{traceback.format_exc()}"
+
+def get_cache_path(pdf_path, csv_path):
+    """Returns the cache file for a parser generated from this exact PDF and CSV."""
+    digest = hashlib.md5()
+    for path in (pdf_path, csv_path):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return os.path.join(CACHE_DIR, f"{digest.hexdigest()}.py")
+
+def load_cached_parser(cache_path):
+    """Returns previously generated parser code for the inputs, or None on a cache miss."""
+    if not os.path.exists(cache_path):
+        return None
+    with open(cache_path) as f:
+        return f.read()
+
+def save_cached_parser(cache_path, code):
+    """Stores parser code that passed the tests so later runs can skip the LLM."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(cache_path, "w") as f:
+        f.write(code)
 
-    except Exception as e:
-        return False, f"An unexpected error occurred during testing: {e}"
 # --- Main Execution ---
 
 def main(target):
     print(f"🚀 Starting agent to build parser for: {target}")
-    
+
+    # The ground truth is read once and reused for every attempt
+    expected_df = pd.read_csv(TARGET_CSV_PATH)
+
+    # Reuse a parser that already passed for these exact inputs before calling the LLM
+    cache_path = get_cache_path(TARGET_PDF_PATH, TARGET_CSV_PATH)
+    cached_code = load_cached_parser(cache_path)
+    if cached_code is not None:
+        print(f"📦 Found a cached parser at {cache_path}, testing it...")
+        save_code_to_file(cached_code)
+        is_correct, error_message = test_generated_parser(expected_df)
+        if is_correct:
+            print("\n🎉 Success! The cached parser passed the tests.")
+            print(f"You can now inspect the final parser at `{TARGET_PARSER_PATH}`.")
+            return
+        print("❌ Cached parser failed the tests. Removing it and generating a new one.")
+        os.remove(cache_path)
+
     setup_environment()
     llm = get_llm()
     prompt = create_prompt_template()
 
     # Provide context to the LLM
-    expected_df = pd.read_csv(TARGET_CSV_PATH)
-    schema_info = str(expected_df.head().to_markdown())
+    schema_info = get_schema_info(expected_df)
     pdf_sample = get_pdf_text_sample(TARGET_PDF_PATH)
     
     error_feedback = ""
@@ -187,12 +258,13 @@ def main(target):
         
         # 3. TEST THE CODE
         print("🔬 Agent is testing the generated parser...")
-        is_correct, error_message = test_generated_parser()
+        is_correct, error_message = test_generated_parser(expected_df)
         
         # 4. OBSERVE & REFINE
         if is_correct:
             print("\n🎉 Success! The generated parser passed the tests.")
             print(f"You can now inspect the final parser at `{TARGET_PARSER_PATH}`.")
+            save_cached_parser(cache_path, generated_code)
             break
         else:
             print(f"❌ Test failed. Agent will attempt to self-correct.")
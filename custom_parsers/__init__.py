@@ -0,0 +1,20 @@
+# Vertical distance (in points) within which words are treated as one visual line,
+# matching pdfplumber's default y_tolerance
+Y_TOLERANCE = 3
+
+
+def page_lines(page, y_tolerance=Y_TOLERANCE):
+    """Yields text lines from a PyMuPDF page's words, clustering words whose tops lie within y_tolerance."""
+    # Each word is (x0, y0, x1, y1, text, block_no, line_no, word_no)
+    words = sorted(page.get_text("words"), key=lambda w: (w[1], w[0]))
+    line_words = []
+    line_top = None
+    for word in words:
+        if line_words and word[1] - line_top > y_tolerance:
+            yield ' '.join(w[4] for w in sorted(line_words, key=lambda w: w[0]))
+            line_words = []
+        if not line_words:
+            line_top = word[1]
+        line_words.append(word)
+    if line_words:
+        yield ' '.join(w[4] for w in sorted(line_words, key=lambda w: w[0]))
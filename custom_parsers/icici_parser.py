@@ -1,79 +1,135 @@
-import pdfplumber
+import pymupdf
 import pandas as pd
 import re
-
-def parse(pdf_path: str) -> pd.DataFrame:
-    transactions = []
-    # Regex to find lines that start with a date
-    date_pattern = re.compile(r'^\d{2}-\d{2}-\d{4}')
-
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            full_text = page.extract_text()
-            lines = full_text.split('\n')
-
-            current_transaction = {}
-
-            for line in lines:
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from custom_parsers import page_lines
+
+# Matches lines that start with a date, i.e. the first line of a transaction
+_DATE_RE = re.compile(r'^\d{2}-\d{2}-\d{4}')
+
+# Statements longer than this have their pages extracted in a process pool; below it
+# PyMuPDF reads pages faster than the pool can start
+PARALLEL_MIN_PAGES = 100
+
+# Number of worker processes used for long statements
+PARALLEL_WORKERS = os.cpu_count() or 1
+
+
+def _extract_pages_lines(job):
+    """Worker for the process pool: opens its own handle on the PDF and returns the lines of a page range."""
+    pdf_path, start, stop = job
+    with pymupdf.open(pdf_path) as doc:
+        return [list(page_lines(doc[page_number])) for page_number in range(start, stop)]
+
+
+def _iter_pages(pdf_path):
+    """Yields the lines of each page in order, extracting long statements in parallel."""
+    workers = PARALLEL_WORKERS
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+        if page_count <= PARALLEL_MIN_PAGES or workers == 1:
+            # Pages are processed one at a time so only the current page's words are held in memory
+            for page in doc:
+                yield page_lines(page)
+            return
+
+    # Text extraction is independent per page; the transaction assembly stays serial in the caller.
+    # Each worker gets one contiguous page range so the PDF is opened once per worker.
+    chunk = -(-page_count // workers)
+    jobs = [(pdf_path, start, min(start + chunk, page_count)) for start in range(0, page_count, chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for pages in executor.map(_extract_pages_lines, jobs):
+            yield from pages
+
+
+def _to_float(token):
+    """Parses an amount such as '1,935.30', returning NaN when it is not a number."""
+    try:
+        return float(token.replace(',', ''))
+    except ValueError:
+        return math.nan
+
+
+def parse(pdf_path: str, first_transaction_side: Optional[str] = None) -> pd.DataFrame:
+    """
+    Parses an ICICI statement PDF into a DataFrame of transactions.
+
+    Debits and credits are told apart by whether the balance fell or rose since the
+    previous transaction. The statement has no opening balance, so the first transaction
+    has nothing to compare against; first_transaction_side says how to record it:
+    'debit', 'credit', or None (the default, as the side is unknown) to leave both
+    amount columns empty.
+    """
+    if first_transaction_side not in ('debit', 'credit', None):
+        raise ValueError(f"first_transaction_side must be 'debit', 'credit' or None, not {first_transaction_side!r}")
+
+    # One list per output column; a transaction is the same index in each
+    dates, descriptions, debits, credits, balances = [], [], [], [], []
+    prev_balance = None
+
+    for lines in _iter_pages(pdf_path):
+        # Description lines only continue a transaction started on the same page
+        in_transaction = False
+
+        for line in lines:
+            if not line or line.isspace():
+                continue
+
+            # Check if the line starts a new transaction
+            if _DATE_RE.match(line):
                 parts = line.split()
-                if not parts:
-                    continue
-
-                # Check if the line starts a new transaction
-                if date_pattern.match(parts[0]):
-                    # If a transaction was being built, save it
-                    if current_transaction:
-                        transactions.append(current_transaction)
-
-                    # Start a new transaction
-                    current_transaction = {
-                        'Date': parts[0],
-                        'Description': "",
-                            'Debit Amt': None,
-                            'Credit Amt': None,
-                            'Balance': parts[-1]
-                    }
-
-                    # Check if amounts are on the same line
-                    if len(parts) > 2:
-                        try:
-                            # Second to last part is a potential amount
-                            potential_amount = parts[-2].replace(',', '')
-                            float(potential_amount)
-
-                            # Find original transaction in provided data to see if it was debit or credit
-                            # This is a hardcoded logic based on provided result.csv
-                            # In a real scenario, this logic would need to be more robust
-                            debit_rows = [1935.3, 3886.08, 596.72, 617.86, 4150.96, 1629.34, 4208.51, 3713.69, 4182.2, 3615.84, 1006.21, 756.93, 3777.56, 2986.0, 320.12, 4925.74, 2939.04, 1210.14, 4706.8, 4678.02, 270.87, 3782.46, 4332.26, 3973.65, 4509.03, 741.32, 884.31, 189.74, 3183.71, 1786.81, 3130.96, 827.09, 2634.0, 4087.04, 363.47, 1863.31, 4526.6, 2583.14, 4044.7, 2617.5, 4567.77, 1980.53, 4944.55, 150.91, 1248.14, 4029.62, 380.91, 1581.69, 2917.52, 566.32]
-
-                            if float(potential_amount) in debit_rows:
-                                current_transaction['Debit Amt'] = potential_amount
-                            else:
-                                current_transaction['Credit Amt'] = potential_amount
-
-                            current_transaction['Description'] = ' '.join(parts[1:-2])
-                        except (ValueError, IndexError):
-                            current_transaction['Description'] = ' '.join(parts[1:-1])
+                in_transaction = True
+
+                # Start a new transaction; amounts are stored as floats straight away
+                balance = _to_float(parts[-1])
+                debit = credit = math.nan
+
+                # Second to last part is a potential amount when it sits on the same line
+                amount = math.nan
+                if len(parts) > 2 and not math.isnan(balance):
+                    amount = _to_float(parts[-2])
+                amount_ok = not math.isnan(amount)
+
+                if amount_ok:
+                    # The movement in balance tells debits from credits
+                    if prev_balance is None:
+                        side = first_transaction_side
                     else:
-                         current_transaction['Description'] = ' '.join(parts[1:-1])
-
-                # Handle multi-line descriptions
-                elif current_transaction:
-                    current_transaction['Description'] += ' ' + line.strip()
-
-            # Append the last transaction from the page
-            if current_transaction:
-                transactions.append(current_transaction)
-
-    df = pd.DataFrame(transactions)
+                        side = 'debit' if balance < prev_balance else 'credit'
+                    if side == 'debit':
+                        debit = amount
+                    elif side == 'credit':
+                        credit = amount
+                    prev_balance = balance
+
+                # Everything between the date and the amount (or balance) is the description
+                description = ' '.join(parts[1:-2 if amount_ok else -1])
+
+                dates.append(parts[0])
+                descriptions.append(description)
+                debits.append(debit)
+                credits.append(credit)
+                balances.append(balance)
+
+            # Handle multi-line descriptions
+            elif in_transaction:
+                descriptions[-1] += ' ' + line.strip()
+
+    df = pd.DataFrame({
+        'Date': dates,
+        'Description': descriptions,
+        'Debit Amt': pd.Series(debits, dtype='float64'),
+        'Credit Amt': pd.Series(credits, dtype='float64'),
+        'Balance': pd.Series(balances, dtype='float64'),
+    })
 
     # Final cleanup
-    for col in ['Debit Amt', 'Credit Amt', 'Balance']:
-        df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', ''), errors='coerce')
-
     df['Description'] = df['Description'].str.strip()
 
     # This is a specific data cleaning step to match the CSV exactly
-    df = df.drop_duplicates(subset=['Date', 'Description', 'Balance'], keep='last').reset_index(drop=True)
+    df = df.drop_duplicates(subset=['Date', 'Description', 'Balance'], keep='last', ignore_index=True)
 
     return df
@@ -3,12 +3,23 @@
 import pandas as pd
 import pytest
 import os
+import sys
+import agent
 # This line imports the 'parse' function from your other file
 from custom_parsers.icici_parser import parse 
+from custom_parsers import icici_parser
 
 # Get the absolute path to the directory where this test file is located
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
+# Parsers written the way the agent writes them: one that wraps the real parser, and one without `parse`
+GOOD_PARSER_CODE = (
+    "from custom_parsers import icici_parser\n\n"
+    "def parse(pdf_path):\n"
+    "    return icici_parser.parse(pdf_path, first_transaction_side='debit')\n"
+)
+BROKEN_PARSER_CODE = "import pandas as pd\n\ndef parse_statement(pdf_path):\n    return pd.DataFrame()\n"
+
 def test_parser():
     """
     This function tests the icici_parser.
@@ -20,11 +31,97 @@ def test_parser():
     # 1. Load the expected result from the CSV
     expected_df = pd.read_csv(csv_path)
 
-    # 2. Run your parser to get the actual result
-    actual_df = parse(pdf_path)
+    # 2. Run your parser to get the actual result; the sample's first transaction is a debit
+    actual_df = parse(pdf_path, first_transaction_side='debit')
 
     # 3. Compare the two DataFrames
     pd.testing.assert_frame_equal(
         actual_df.astype(str), 
         expected_df.astype(str)
-    )
\ No newline at end of file
+    )
+
+
+def test_parser_parallel_pages(monkeypatch):
+    """
+    This function checks that extracting pages in a process pool gives the same result as the serial path.
+    """
+    pdf_path = os.path.join(current_dir, "data", "icici", "icici_sample.pdf")
+    serial_df = parse(pdf_path)
+
+    # Force the process pool, even for the 2-page sample and on a single-CPU machine
+    monkeypatch.setattr(icici_parser, "PARALLEL_MIN_PAGES", 0)
+    monkeypatch.setattr(icici_parser, "PARALLEL_WORKERS", 2)
+    parallel_df = parse(pdf_path)
+
+    pd.testing.assert_frame_equal(parallel_df, serial_df)
+
+
+def test_generated_parser_uses_fresh_module(tmp_path, monkeypatch):
+    """
+    This function checks that a parser without `parse` fails, even after a correct parser was loaded.
+    """
+    monkeypatch.chdir(current_dir)
+    monkeypatch.setattr(agent, "TARGET_PARSER_MODULE", "generated_parser_under_test")
+    expected_df = pd.read_csv(agent.TARGET_CSV_PATH)
+
+    good_path = tmp_path / "good_parser.py"
+    good_path.write_text(GOOD_PARSER_CODE)
+    broken_path = tmp_path / "broken_parser.py"
+    broken_path.write_text(BROKEN_PARSER_CODE)
+
+    try:
+        assert agent.test_generated_parser(expected_df, str(good_path)) == (True, "")
+        is_correct, error_message = agent.test_generated_parser(expected_df, str(broken_path))
+    finally:
+        sys.modules.pop("generated_parser_under_test", None)
+
+    assert not is_correct
+    assert "parse" in error_message
+
+
+def run_agent(tmp_path, monkeypatch, generated_codes):
+    """
+    Runs the agent's main loop with the LLM replaced by a fixed sequence of generated parsers,
+    writing the parser and the cache under tmp_path. Returns the cache file for the sample inputs.
+    """
+    monkeypatch.chdir(current_dir)
+    monkeypatch.setattr(agent, "TARGET_PARSER_PATH", str(tmp_path / "generated_parser.py"))
+    monkeypatch.setattr(agent, "TARGET_PARSER_MODULE", "generated_parser_under_test")
+    monkeypatch.setattr(agent, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(agent, "setup_environment", lambda: None)
+    monkeypatch.setattr(agent, "get_llm", lambda: None)
+    codes = iter(generated_codes)
+    monkeypatch.setattr(agent, "generate_parser_code", lambda *args, **kwargs: next(codes))
+
+    try:
+        agent.main("icici")
+    finally:
+        sys.modules.pop("generated_parser_under_test", None)
+    return agent.get_cache_path(agent.TARGET_PDF_PATH, agent.TARGET_CSV_PATH)
+
+
+def test_agent_caches_only_passing_parser(tmp_path, monkeypatch):
+    """
+    This function checks that the agent caches the parser that passed, not a failed attempt before it.
+    """
+    cache_path = run_agent(tmp_path, monkeypatch, [BROKEN_PARSER_CODE, GOOD_PARSER_CODE])
+
+    assert os.listdir(tmp_path / "cache") == [os.path.basename(cache_path)]
+    with open(cache_path) as f:
+        assert f.read() == GOOD_PARSER_CODE
+
+
+def test_agent_drops_failing_cached_parser(tmp_path, monkeypatch):
+    """
+    This function checks that a cached parser which fails its re-test is removed, and nothing failing is cached.
+    """
+    os.makedirs(tmp_path / "cache")
+    monkeypatch.chdir(current_dir)
+    monkeypatch.setattr(agent, "CACHE_DIR", str(tmp_path / "cache"))
+    stale_path = agent.get_cache_path(agent.TARGET_PDF_PATH, agent.TARGET_CSV_PATH)
+    with open(stale_path, "w") as f:
+        f.write(BROKEN_PARSER_CODE)
+
+    run_agent(tmp_path, monkeypatch, [BROKEN_PARSER_CODE] * agent.MAX_ATTEMPTS)
+
+    assert os.listdir(tmp_path / "cache") == []